@@ -14,10 +14,306 @@ from pathlib import Path
 import logging
 import tempfile
 import re
+import mmap
+import codecs
+import json
+import time
+import queue
+import threading
+import subprocess
+import signal
+from concurrent.futures import ThreadPoolExecutor
+import shutil
+from urllib.parse import unquote
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# El logging se configura en main(); como libreria no se toca el logger raiz
 registro = logging.getLogger(__name__)
+registro.addHandler(logging.NullHandler())
+
+# Tipos de eventos estructurados de progreso (ver emitir_evento)
+EVENTO_LOTE_INICIADO = 'lote_iniciado'
+EVENTO_ARCHIVO_ENCOLADO = 'archivo_encolado'
+EVENTO_ARCHIVO_INICIADO = 'archivo_iniciado'
+EVENTO_ETAPA_FINALIZADA = 'etapa_finalizada'
+EVENTO_ARCHIVO_CONVERTIDO = 'archivo_convertido'
+EVENTO_ARCHIVO_FALLIDO = 'archivo_fallido'
+EVENTO_LOTE_FINALIZADO = 'lote_finalizado'
+
+# Firmas de cabecera de los formatos de imagen aceptados por el plugin de Moodle
+FIRMAS_IMAGEN = [
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+]
+
+# Marcas BOM en orden de deteccion (UTF-32 antes que UTF-16: comparten prefijo)
+MARCAS_BOM = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# Palabras clave que indican comentarios de codigo mal interpretados como titulos H1
+PALABRAS_CLAVE_CODIGO = [
+    'estilo imperativo', 'estilo funcional', 'funcion pura', 'funcion impura',
+    'matematicamente:', 'composicion', 'resultado:', 'funcion que recibe',
+    'funcion que retorna', 'modifica el estado', 'crea nuevos estados',
+    'acumulacion funcional', 'transformacion de datos', 'uso',
+    'estructura de datos', 'funciones puras', 'combinando ambos'
+]
+
+# Bloque de bytes que se entrega a chardet en cada paso
+TAMANO_BLOQUE_LECTURA = 64 * 1024
+
+# Vallas de bloques de codigo, titulos H1-H3 e imagenes (la valla se evalua primero).
+# El texto del titulo se captura con una anticipacion para no consumir la linea
+# y poder encontrar tambien las imagenes que contenga
+PATRON_ESTRUCTURA = re.compile(
+    r'^[ \t]*(?P<valla>```+|~~~+)'
+    r'|^(?P<nivel>#{1,3}) (?=(?P<titulo>[^#\r\n][^\r\n]*))'
+    r'|!\[[^\]\r\n]*\]\((?P<imagen>[^)\r\n]*)\)',
+    re.MULTILINE
+)
+
+# Estimacion de memoria por trabajo (MB por MB de entrada). La parte de pandoc
+# tiene una base fija y queda acotada por --memoria-maxima; la del proceso Python
+# (texto decodificado, AST de json.loads, json.dumps y su copia codificada) no
+# tiene limite. Factor de Python medido con tracemalloc: ~70x en un documento
+# con mucho codigo
+MEMORIA_BASE_TRABAJO_MB = 200
+FACTOR_MEMORIA_PANDOC = 40
+FACTOR_MEMORIA_PYTHON = 80
+
+# Fraccion de la memoria disponible que puede ocupar un lote en paralelo
+FRACCION_MEMORIA_LOTE = 0.8
+
+# Espacio de direcciones extra sobre el limite de heap de pandoc (binario, pilas, RTS)
+MARGEN_ESPACIO_DIRECCIONES_MB = 512
+
+# Mensajes de pandoc/GHC que indican que se agoto la memoria permitida
+MENSAJES_MEMORIA_AGOTADA = ['Heap exhausted', 'out of memory', 'Cannot allocate memory']
+
+# Senales con las que muere pandoc al quedarse sin memoria (SIGKILL no existe en Windows)
+SENALES_MEMORIA_AGOTADA = [-getattr(signal, nombre) for nombre in ('SIGKILL', 'SIGSEGV')
+                           if hasattr(signal, nombre)]
+
+def configurar_registro(detallado=False):
+    """
+    Configura el logging de la linea de comandos. No se ejecuta al importar el
+    modulo para no interferir con la configuracion de quien lo use como libreria
+    
+    Args:
+        detallado (bool): Si mostrar mensajes de nivel DEBUG
+    """
+    logging.basicConfig(level=logging.DEBUG if detallado else logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+def emitir_evento(al_evento, tipo, **datos):
+    """
+    Envia un evento estructurado al callback indicado. Los errores del callback
+    se registran pero nunca interrumpen la conversion
+    
+    Args:
+        al_evento (callable): Funcion que recibe el evento (dict) o None
+        tipo (str): Tipo de evento (constantes EVENTO_*)
+        **datos: Campos adicionales del evento
+    """
+    if al_evento is None:
+        return
+    evento = {'tipo': tipo, 'marca_tiempo': time.time()}
+    evento.update(datos)
+    try:
+        al_evento(evento)
+    except Exception as e:
+        registro.warning(f"Error en callback de eventos: {e}")
+
+def crear_seguimiento_progreso(al_evento, bytes_totales, total_archivos):
+    """
+    Envuelve un callback de eventos para anadir progreso, rendimiento y tiempo
+    estimado restante a los eventos de archivo terminado
+    
+    Args:
+        al_evento (callable): Callback de eventos original
+        bytes_totales (int): Suma del tamano de las entradas del lote
+        total_archivos (int): Numero de archivos del lote
+    
+    Returns:
+        callable: Callback que completa los eventos y los reenvia
+    """
+    inicio = time.perf_counter()
+    estado = {'completados': 0, 'bytes_procesados': 0}
+    bloqueo = threading.Lock()
+    
+    def al_evento_con_progreso(evento):
+        # Los eventos se entregan de uno en uno aunque los trabajos corran en paralelo
+        with bloqueo:
+            if evento['tipo'] in (EVENTO_ARCHIVO_CONVERTIDO, EVENTO_ARCHIVO_FALLIDO):
+                estado['completados'] += 1
+                estado['bytes_procesados'] += evento.get('bytes_entrada', 0)
+                transcurrido = time.perf_counter() - inicio
+                rendimiento = estado['bytes_procesados'] / transcurrido if transcurrido > 0 else 0.0
+                restantes = bytes_totales - estado['bytes_procesados']
+                evento.update({
+                    'completados': estado['completados'],
+                    'total_archivos': total_archivos,
+                    'bytes_procesados': estado['bytes_procesados'],
+                    'bytes_totales': bytes_totales,
+                    'rendimiento_bytes_s': round(rendimiento, 1),
+                    'eta_s': round(restantes / rendimiento, 2) if rendimiento > 0 else None,
+                })
+            al_evento(evento)
+    
+    return al_evento_con_progreso
+
+class ErrorLimitePandoc(Exception):
+    """Pandoc supero el tiempo o la memoria asignados y fue detenido"""
+    
+    def __init__(self, mensaje, motivo):
+        super().__init__(mensaje)
+        self.motivo = motivo
+
+def ejecutar_pandoc(argumentos, entrada=None, tiempo_maximo=None, memoria_maxima_mb=None):
+    """
+    Ejecuta pandoc como subproceso con limites opcionales de tiempo y memoria.
+    La memoria se limita con +RTS -M (heap de pandoc) y, en Linux, tambien con
+    RLIMIT_AS lanzando pandoc a traves de prlimit (util-linux), que fija el
+    limite y hace exec del comando. No se usa preexec_fn porque no es seguro
+    con hilos. En Windows, macOS o sin prlimit solo se aplica +RTS -M, que
+    limita el heap de pandoc pero no el resto de su espacio de direcciones
+    
+    Args:
+        argumentos (list): Argumentos de linea de comandos para pandoc
+        entrada (bytes): Datos para la entrada estandar (opcional)
+        tiempo_maximo (float): Segundos antes de detener el proceso (opcional)
+        memoria_maxima_mb (int): Memoria maxima del proceso en MB (opcional)
+    
+    Returns:
+        bytes: Salida estandar de pandoc
+    
+    Raises:
+        ErrorLimitePandoc: Si pandoc supera alguno de los limites
+        RuntimeError: Si pandoc termina con error por otro motivo
+    """
+    comando = [pypandoc.get_pandoc_path()] + list(argumentos)
+    
+    if memoria_maxima_mb:
+        comando.extend(['+RTS', f'-M{memoria_maxima_mb}m', '-RTS'])
+        ruta_prlimit = shutil.which('prlimit')
+        if ruta_prlimit:
+            limite_bytes = (memoria_maxima_mb + MARGEN_ESPACIO_DIRECCIONES_MB) * 1024 * 1024
+            comando = [ruta_prlimit, f'--as={limite_bytes}', '--'] + comando
+    
+    if tiempo_maximo is not None and tiempo_maximo <= 0:
+        raise ErrorLimitePandoc("Tiempo maximo agotado antes de iniciar pandoc", 'tiempo_agotado')
+    
+    try:
+        # subprocess.run mata el proceso al vencer el tiempo (prlimit hace exec,
+        # asi que el proceso es el propio pandoc)
+        resultado = subprocess.run(comando, input=entrada, capture_output=True, timeout=tiempo_maximo)
+    except subprocess.TimeoutExpired:
+        raise ErrorLimitePandoc(f"pandoc no termino en {tiempo_maximo:.1f}s y fue detenido",
+                                'tiempo_agotado')
+    
+    if resultado.returncode != 0:
+        error = resultado.stderr.decode('utf-8', errors='replace').strip()
+        if resultado.returncode == -signal.SIGINT:
+            # pandoc recibio el Ctrl+C junto con este proceso
+            raise KeyboardInterrupt
+        # Con limite de memoria activo: 251 es el codigo de GHC al agotar el heap,
+        # "Cannot allocate memory" es un mmap rechazado por RLIMIT_AS y SIGKILL o
+        # SIGSEGV son el OOM killer o una reserva fallida; otras senales son errores
+        if memoria_maxima_mb and (resultado.returncode == 251
+                                  or resultado.returncode in SENALES_MEMORIA_AGOTADA
+                                  or any(mensaje in error for mensaje in MENSAJES_MEMORIA_AGOTADA)):
+            raise ErrorLimitePandoc(f"pandoc supero el limite de memoria ({memoria_maxima_mb} MB) y fue detenido",
+                                    'memoria_excedida')
+        raise RuntimeError(f"pandoc termino con codigo {resultado.returncode}: {error}")
+    
+    # Avisos de pandoc en una conversion correcta (p. ej. imagenes que no pudo cargar)
+    for linea in resultado.stderr.decode('utf-8', errors='replace').splitlines():
+        if linea.strip():
+            registro.warning(f"pandoc: {linea.strip()}")
+    
+    return resultado.stdout
+
+def memoria_disponible_mb():
+    """
+    Obtiene la memoria disponible del sistema
+    
+    Returns:
+        int: Memoria disponible en MB, o None si no se puede determinar
+    """
+    try:
+        with open('/proc/meminfo') as archivo:
+            for linea in archivo:
+                if linea.startswith('MemAvailable:'):
+                    return int(linea.split()[1]) // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def estimar_memoria_trabajo_mb(bytes_entrada, memoria_maxima_mb=None):
+    """
+    Estima la memoria que necesita convertir un archivo de un tamano dado: la
+    del proceso pandoc (acotada por el limite) mas la del proceso Python, que
+    el limite no cubre
+    
+    Args:
+        bytes_entrada (int): Tamano del archivo .md
+        memoria_maxima_mb (int): Limite de memoria por proceso pandoc (opcional)
+    
+    Returns:
+        int: Memoria estimada en MB
+    """
+    tamano_mb = bytes_entrada / (1024 * 1024)
+    memoria_pandoc = MEMORIA_BASE_TRABAJO_MB + FACTOR_MEMORIA_PANDOC * tamano_mb
+    if memoria_maxima_mb:
+        memoria_pandoc = min(memoria_pandoc, memoria_maxima_mb)
+    memoria_python = FACTOR_MEMORIA_PYTHON * tamano_mb
+    return int(memoria_pandoc + memoria_python)
+
+class PresupuestoMemoria:
+    """
+    Reparte un presupuesto de memoria entre los trabajos en curso. Un trabajo
+    espera hasta que su estimacion quepa; si no cabria nunca, se ejecuta solo.
+    Al cancelar el lote, los trabajos en espera se despiertan y no reservan
+    """
+    
+    def __init__(self, total_mb):
+        self.total_mb = total_mb
+        self.en_uso_mb = 0
+        self.cancelado = False
+        self._condicion = threading.Condition()
+    
+    def reservar(self, memoria_mb):
+        """
+        Returns:
+            bool: True si se reservo la memoria, False si el lote fue cancelado
+        """
+        with self._condicion:
+            while (not self.cancelado and self.total_mb is not None and self.en_uso_mb > 0
+                   and self.en_uso_mb + memoria_mb > self.total_mb):
+                self._condicion.wait()
+            if self.cancelado:
+                return False
+            self.en_uso_mb += memoria_mb
+            return True
+    
+    def cancelar(self):
+        with self._condicion:
+            self.cancelado = True
+            self._condicion.notify_all()
+    
+    def liberar(self, memoria_mb):
+        with self._condicion:
+            self.en_uso_mb -= memoria_mb
+            self._condicion.notify_all()
 
 def crear_plantilla_moodle():
     """
@@ -110,6 +406,110 @@ def crear_plantilla_moodle():
         registro.warning(f"Error creando plantilla: {e}. Usando configuracion basica.")
         return None
 
+def detectar_bom(buffer):
+    """
+    Detecta la marca de orden de bytes (BOM) al inicio de un buffer
+    
+    Args:
+        buffer: Objeto tipo bytes (bytes, mmap, memoryview)
+    
+    Returns:
+        str: Codificacion indicada por el BOM o None si no hay BOM
+    """
+    inicio = bytes(buffer[:4])
+    for marca, codificacion in MARCAS_BOM:
+        if inicio.startswith(marca):
+            return codificacion
+    return None
+
+def leer_archivo_mapeado(ruta_archivo, chardet=None):
+    """
+    Lee un archivo de texto mediante mmap. El BOM y la validez UTF-8 se comprueban
+    sobre el buffer mapeado y el contenido se decodifica una unica vez
+    
+    Args:
+        ruta_archivo (str): Ruta del archivo a leer
+        chardet (module): Modulo chardet para detectar codificaciones no UTF-8 (opcional)
+    
+    Returns:
+        str: Contenido decodificado
+    """
+    with open(ruta_archivo, 'rb') as archivo:
+        if os.fstat(archivo.fileno()).st_size == 0:
+            return ''
+        with mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+            with memoryview(mapa) as vista:
+                codificacion = detectar_bom(vista)
+                if codificacion:
+                    registro.info(f"BOM detectado: {codificacion}")
+                    return str(vista, codificacion, 'replace')
+                
+                # La decodificacion UTF-8 valida y convierte en una sola pasada;
+                # si el buffer no es UTF-8 valido falla sin generar el texto
+                try:
+                    contenido = str(vista, 'utf-8')
+                    registro.info("Archivo decodificado exitosamente con: utf-8")
+                    return contenido
+                except UnicodeDecodeError:
+                    pass
+                
+                # Detectar la codificacion por bloques para no copiar el archivo completo
+                codificacion = 'latin-1'
+                if chardet is not None:
+                    detector = chardet.UniversalDetector()
+                    for desplazamiento in range(0, len(vista), TAMANO_BLOQUE_LECTURA):
+                        detector.feed(vista[desplazamiento:desplazamiento + TAMANO_BLOQUE_LECTURA])
+                        if detector.done:
+                            break
+                    resultado_deteccion = detector.close()
+                    if resultado_deteccion['encoding'] and resultado_deteccion['confidence'] > 0.7:
+                        codificacion = resultado_deteccion['encoding']
+                        registro.info(f"Codificacion detectada: {codificacion}")
+                    else:
+                        registro.warning("Baja confianza en deteccion de codificacion")
+                
+                try:
+                    contenido = str(vista, codificacion)
+                except (UnicodeDecodeError, LookupError):
+                    codificacion = 'latin-1'
+                    contenido = str(vista, codificacion)
+                registro.info(f"Archivo decodificado exitosamente con: {codificacion}")
+                return contenido
+
+def analizar_estructura_texto(texto):
+    """
+    Recoge los titulos H1, H2 y H3 y las referencias de imagen que estan fuera
+    de bloques de codigo (``` o ~~~) en una sola pasada sobre el texto, sin
+    dividirlo en lineas
+    
+    Args:
+        texto (str): Contenido Markdown
+    
+    Returns:
+        dict: Claves 'h1', 'h2' y 'h3' con los titulos encontrados e 'imagenes'
+            con el contenido entre parentesis de cada ![...](...)
+    """
+    estructura = {'h1': [], 'h2': [], 'h3': [], 'imagenes': []}
+    valla_abierta = None
+    
+    for coincidencia in PATRON_ESTRUCTURA.finditer(texto):
+        valla = coincidencia.group('valla')
+        if valla:
+            if valla_abierta is None:
+                valla_abierta = valla
+            elif valla[0] == valla_abierta[0] and len(valla) >= len(valla_abierta):
+                valla_abierta = None
+            continue
+        if valla_abierta is not None:
+            continue
+        if coincidencia.group('nivel'):
+            nivel = len(coincidencia.group('nivel'))
+            estructura[f'h{nivel}'].append(coincidencia.group(0) + coincidencia.group('titulo'))
+        else:
+            estructura['imagenes'].append(coincidencia.group('imagen'))
+    
+    return estructura
+
 def detectar_y_corregir_codificacion(ruta_archivo):
     """
     Detecta automaticamente la codificacion de un archivo y corrige problemas comunes
@@ -137,36 +537,9 @@ def detectar_y_corregir_codificacion(ruta_archivo):
             tiene_ftfy = False
             registro.warning("ftfy no disponible. Usando correccion basica de caracteres.")
         
-        # Leer archivo en modo binario para deteccion de codificacion
-        with open(ruta_archivo, 'rb') as archivo:
-            datos_binarios = archivo.read()
-        
-        # Detectar codificacion automaticamente si chardet esta disponible
-        codificacion_detectada = 'utf-8'
-        if tiene_chardet:
-            resultado_deteccion = chardet.detect(datos_binarios)
-            if resultado_deteccion['confidence'] > 0.7:
-                codificacion_detectada = resultado_deteccion['encoding']
-                registro.info(f"Codificacion detectada: {codificacion_detectada}")
-            else:
-                registro.warning("Baja confianza en deteccion de codificacion")
-        
-        # Intentar decodificar con la codificacion detectada
-        contenido = None
-        codificaciones_intentar = [codificacion_detectada, 'utf-8', 'latin-1', 'cp1252', 'iso-8859-1']
-        
-        for codificacion in codificaciones_intentar:
-            try:
-                contenido = datos_binarios.decode(codificacion)
-                registro.info(f"Archivo decodificado exitosamente con: {codificacion}")
-                break
-            except UnicodeDecodeError:
-                continue
-        
-        if contenido is None:
-            # Ultimo recurso: decodificar con errores ignored
-            contenido = datos_binarios.decode('utf-8', errors='ignore')
-            registro.warning("Usando decodificacion con errores ignorados")
+        # Mapear el archivo en memoria: la deteccion trabaja sobre el buffer
+        # mapeado sin copiarlo y solo se decodifica una vez al texto final
+        contenido = leer_archivo_mapeado(ruta_archivo, chardet if tiene_chardet else None)
         
         # Aplicar ftfy para reparar texto mal codificado
         if tiene_ftfy:
@@ -240,16 +613,89 @@ def aplicar_correcciones_basicas(contenido):
         registro.warning(f"Error en correcciones basicas: {e}")
         return contenido
 
-def procesar_markdown_previo(ruta_archivo_md):
+def texto_plano_ast(nodo):
+    """
+    Obtiene el texto plano de una lista de elementos inline del AST de pandoc
+    
+    Args:
+        nodo: Elemento o lista de elementos del AST (JSON de pandoc)
+    
+    Returns:
+        str: Texto sin formato
+    """
+    if isinstance(nodo, list):
+        return ''.join(texto_plano_ast(elemento) for elemento in nodo)
+    if isinstance(nodo, dict):
+        tipo = nodo.get('t')
+        if tipo == 'Str':
+            return nodo['c']
+        if tipo in ('Space', 'SoftBreak', 'LineBreak'):
+            return ' '
+        if tipo in ('Code', 'Math', 'RawInline'):
+            return nodo['c'][-1]
+        return texto_plano_ast(nodo.get('c', []))
+    return ''
+
+def filtrar_ast_moodle(nodo, estadisticas=None):
+    """
+    Filtro del AST de pandoc para Moodle: convierte en bloques de codigo los
+    titulos H1 falsos (comentarios de codigo interpretados como capitulos) y
+    cuenta los capitulos y subcapitulos reales. Modifica el AST en sitio
+    
+    Args:
+        nodo: AST de pandoc (dict con 'blocks') o cualquier sub-nodo
+        estadisticas (dict): Contadores acumulados (uso interno en la recursion)
+    
+    Returns:
+        dict: Contadores 'capitulos', 'subcapitulos' y 'corregidos'
+    """
+    if estadisticas is None:
+        estadisticas = {'capitulos': 0, 'subcapitulos': 0, 'corregidos': 0}
+    
+    if isinstance(nodo, dict):
+        hijos = nodo.get('blocks', nodo.get('c'))
+        if isinstance(hijos, list):
+            filtrar_ast_moodle(hijos, estadisticas)
+        return estadisticas
+    
+    if not isinstance(nodo, list):
+        return estadisticas
+    
+    for indice, elemento in enumerate(nodo):
+        if isinstance(elemento, dict) and elemento.get('t') == 'Header':
+            nivel, _, contenido = elemento['c']
+            texto = texto_plano_ast(contenido)
+            if nivel == 1 and any(palabra_clave in texto.lower() for palabra_clave in PALABRAS_CLAVE_CODIGO):
+                # Convertir a comentario dentro de bloque de codigo
+                nodo[indice] = {'t': 'CodeBlock', 'c': [['', ['python'], []], f'# {texto}']}
+                estadisticas['corregidos'] += 1
+                registro.info(f"Corregido comentario de codigo: # {texto[:50]}...")
+            elif nivel == 1:
+                estadisticas['capitulos'] += 1
+            elif nivel == 2:
+                estadisticas['subcapitulos'] += 1
+        elif isinstance(elemento, (dict, list)):
+            filtrar_ast_moodle(elemento, estadisticas)
+    
+    return estadisticas
+
+def procesar_markdown_previo(ruta_archivo_md, tiempo_maximo=None, memoria_maxima_mb=None):
     """
     Pre-procesa el archivo Markdown para corregir problemas que impiden 
-    la importacion correcta en Moodle
+    la importacion correcta en Moodle. Pandoc analiza el texto una sola vez y
+    las correcciones se aplican sobre su AST, donde los bloques de codigo
+    (``` o ~~~, anidados o no) ya estan resueltos
     
     Args:
         ruta_archivo_md (str): Ruta del archivo Markdown original
+        tiempo_maximo (float): Segundos maximos para pandoc (opcional)
+        memoria_maxima_mb (int): Memoria maxima para pandoc en MB (opcional)
     
     Returns:
-        str: Ruta del archivo Markdown corregido (temporal)
+        dict: AST de pandoc corregido, o None si no se pudo procesar
+    
+    Raises:
+        ErrorLimitePandoc: Si pandoc supera los limites (no se reintenta)
     """
     try:
         registro.info("Procesando Markdown para compatibilidad con Moodle...")
@@ -258,69 +704,24 @@ def procesar_markdown_previo(ruta_archivo_md):
         contenido_corregido = detectar_y_corregir_codificacion(ruta_archivo_md)
         if not contenido_corregido:
             registro.error("No se pudo leer el archivo de entrada")
-            return ruta_archivo_md
+            return None
         
         registro.info("Codificacion detectada y corregida automaticamente")
         
-        # Corregir estructura de titulos
-        lineas = contenido_corregido.split('\n')
-        lineas_corregidas = []
-        dentro_bloque_codigo = False
-        
-        # Palabras clave que indican comentarios de codigo mal interpretados como titulos
-        palabras_clave_codigo = [
-            'estilo imperativo', 'estilo funcional', 'funcion pura', 'funcion impura',
-            'matematicamente:', 'composicion', 'resultado:', 'funcion que recibe',
-            'funcion que retorna', 'modifica el estado', 'crea nuevos estados',
-            'acumulacion funcional', 'transformacion de datos', 'uso',
-            'estructura de datos', 'funciones puras', 'combinando ambos'
-        ]
+        # Obtener el AST de pandoc y aplicar el filtro de Moodle en proceso
+        ast = json.loads(ejecutar_pandoc(['--from=markdown', '--to=json'], contenido_corregido.encode('utf-8'),
+                                         tiempo_maximo, memoria_maxima_mb))
+        estadisticas = filtrar_ast_moodle(ast)
         
-        for linea in lineas:
-            # Detectar bloques de codigo
-            if linea.strip().startswith('```'):
-                dentro_bloque_codigo = not dentro_bloque_codigo
-                lineas_corregidas.append(linea)
-                continue
-            
-            # Si estamos en un bloque de codigo, no procesar
-            if dentro_bloque_codigo:
-                lineas_corregidas.append(linea)
-                continue
-            
-            # Corregir titulos H1 falsos (comentarios de codigo)
-            if (linea.strip().startswith('# ') and 
-                any(palabra_clave in linea.lower() for palabra_clave in palabras_clave_codigo)):
-                
-                # Convertir a comentario dentro de bloque de codigo
-                lineas_corregidas.append('```python')
-                lineas_corregidas.append(linea)
-                lineas_corregidas.append('```')
-                registro.info(f"Corregido comentario de codigo: {linea.strip()[:50]}...")
-            else:
-                lineas_corregidas.append(linea)
-        
-        contenido_final = '\n'.join(lineas_corregidas)
-        
-        # Validar estructura final
-        titulos_h1 = len(re.findall(r'^# [^#]', contenido_final, re.MULTILINE))
-        titulos_h2 = len(re.findall(r'^## [^#]', contenido_final, re.MULTILINE))
-        
-        registro.info(f"Estructura corregida: {titulos_h1} capitulos, {titulos_h2} subcapitulos")
-        
-        # Crear archivo temporal corregido
-        archivo_temporal = tempfile.NamedTemporaryFile(
-            mode='w', suffix='.md', delete=False, encoding='utf-8'
-        )
-        archivo_temporal.write(contenido_final)
-        archivo_temporal.close()
-        
-        registro.info(f"Archivo Markdown corregido creado: {archivo_temporal.name}")
-        return archivo_temporal.name
+        registro.info(f"Estructura corregida: {estadisticas['capitulos']} capitulos, "
+                      f"{estadisticas['subcapitulos']} subcapitulos")
+        return ast
         
+    except ErrorLimitePandoc:
+        raise
     except Exception as e:
         registro.warning(f"Error en procesamiento previo: {e}")
-        return ruta_archivo_md
+        return None
 
 def validar_estructura_markdown(ruta_archivo_md):
     """
@@ -354,35 +755,22 @@ def validar_estructura_markdown(ruta_archivo_md):
         else:
             registro.info("No se detectaron problemas de codificacion")
         
-        # Analizar estructura sin bloques de codigo
-        lineas = contenido.split('\n')
-        dentro_bloque_codigo = False
-        lineas_limpias = []
-        
-        for linea in lineas:
-            if linea.strip().startswith('```'):
-                dentro_bloque_codigo = not dentro_bloque_codigo
-                continue
-            if not dentro_bloque_codigo:
-                lineas_limpias.append(linea)
-        
-        contenido_limpio = '\n'.join(lineas_limpias)
-        
-        # Contar niveles de encabezados reales
-        titulos_h1_reales = re.findall(r'^# [^#]', contenido_limpio, re.MULTILINE)
-        titulos_h2_reales = re.findall(r'^## [^#]', contenido_limpio, re.MULTILINE)
-        titulos_h3_reales = re.findall(r'^### [^#]', contenido_limpio, re.MULTILINE)
+        # Contar niveles de encabezados reales (fuera de bloques de codigo)
+        titulos = analizar_estructura_texto(contenido)
+        titulos_h1_reales = titulos['h1']
+        titulos_h2_reales = titulos['h2']
+        titulos_h3_reales = titulos['h3']
         
         # Detectar titulos falsos
         palabras_codigo = ['estilo', 'resultado:', 'funcion', 'uso', 'composicion']
         titulos_h1_falsos = []
-        for linea in lineas:
-            if (linea.strip().startswith('# ') and 
-                any(palabra in linea.lower() for palabra in palabras_codigo)):
+        for coincidencia in re.finditer(r'^[ \t]*# [^\r\n]*', contenido, re.MULTILINE):
+            linea = coincidencia.group(0)
+            if any(palabra in linea.lower() for palabra in palabras_codigo):
                 titulos_h1_falsos.append(linea.strip())
         
-        # Detectar imagenes
-        imagenes = re.findall(r'!\[.*?\]\((.*?)\)', contenido)
+        # Imagenes referenciadas fuera de bloques de codigo
+        imagenes = titulos['imagenes']
         
         estructura = {
             'cantidad_h1': len(titulos_h1_reales),
@@ -424,6 +812,130 @@ def validar_estructura_markdown(ruta_archivo_md):
         registro.warning(f"Error validando estructura: {e}")
         return {}
 
+def extraer_rutas_imagenes(referencias):
+    """
+    Normaliza las referencias de imagen capturadas en el Markdown y descarta
+    las que no apuntan a archivos locales (URLs remotas o datos embebidos)
+
+    Args:
+        referencias (list): Contenido entre parentesis de cada ![...](...)
+
+    Returns:
+        list: Rutas locales tal como aparecen en el Markdown
+    """
+    rutas = []
+    for referencia in referencias:
+        referencia = referencia.strip()
+        if referencia.startswith('<') and '>' in referencia:
+            ruta = referencia[1:referencia.index('>')]
+        else:
+            # Quitar el titulo opcional: ![alt](ruta "titulo")
+            ruta = referencia.split()[0] if referencia else ''
+
+        if not ruta or (re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*:', ruta) and not re.match(r'^[a-zA-Z]:[\\/]', ruta)):
+            continue
+        rutas.append(ruta)
+    return rutas
+
+def inspeccionar_imagen(directorio_base, referencia):
+    """
+    Resuelve una referencia de imagen relativa a su directorio y comprueba que
+    exista, sea legible y tenga un formato soportado leyendo solo su cabecera.
+    Si la ruta literal no existe se prueba la ruta decodificada como URL
+    (espacios como %20)
+
+    Args:
+        directorio_base (str): Directorio absoluto del archivo .md
+        referencia (str): Ruta de la imagen tal como aparece en el Markdown
+
+    Returns:
+        dict: Resultado con las claves 'ruta', 'valida', 'formato', 'tamano' y 'problema'
+    """
+    candidatos = [referencia]
+    referencia_decodificada = unquote(referencia)
+    if referencia_decodificada != referencia:
+        candidatos.append(referencia_decodificada)
+
+    for candidato in candidatos:
+        ruta_imagen = os.path.normpath(os.path.join(directorio_base, candidato))
+        resultado = {'ruta': ruta_imagen, 'valida': False, 'formato': None, 'tamano': 0, 'problema': None}
+        try:
+            with open(ruta_imagen, 'rb') as archivo:
+                resultado['tamano'] = os.fstat(archivo.fileno()).st_size
+                cabecera = archivo.read(8)
+        except FileNotFoundError:
+            resultado['problema'] = "no existe"
+            continue
+        except IsADirectoryError:
+            resultado['problema'] = "es un directorio"
+        except OSError as e:
+            resultado['problema'] = f"no se puede leer ({e.strerror or e})"
+        else:
+            for firma, formato in FIRMAS_IMAGEN:
+                if cabecera.startswith(firma):
+                    resultado['formato'] = formato
+                    break
+
+            if resultado['formato']:
+                resultado['valida'] = True
+            else:
+                resultado['problema'] = "formato no soportado, usar PNG, JPEG o GIF"
+        return resultado
+
+    # Ningun candidato existe: informar la ruta literal
+    resultado['ruta'] = os.path.normpath(os.path.join(directorio_base, referencia))
+    return resultado
+
+def verificar_imagenes(imagenes_por_archivo, max_hilos=None):
+    """
+    Resuelve las imagenes de cada Markdown relativas a su propio directorio y
+    las inspecciona en paralelo. Cada ruta se inspecciona una sola vez aunque
+    varios archivos la referencien, o la escriban de forma distinta; los resultados
+    solo valen para esta llamada, asi que una imagen corregida se vuelve a
+    comprobar en el siguiente lote
+
+    Args:
+        imagenes_por_archivo (dict): Ruta del .md -> lista de referencias de imagen
+        max_hilos (int): Numero maximo de hilos (opcional)
+
+    Returns:
+        dict: Ruta del .md -> lista de (referencia, problema) de las imagenes invalidas
+    """
+    # Clave de deduplicacion: ruta normalizada (solo texto, sin llamadas al sistema),
+    # para que "img/a.png" y "./img/a.png" se inspeccionen una sola vez
+    referencias_por_archivo = {}
+    representantes = {}
+    for archivo_md, referencias in imagenes_por_archivo.items():
+        directorio_base = os.path.dirname(os.path.abspath(archivo_md))
+        referencias_por_archivo[archivo_md] = []
+        for referencia in extraer_rutas_imagenes(referencias):
+            clave = os.path.normpath(os.path.join(directorio_base, referencia))
+            representantes.setdefault(clave, (directorio_base, referencia))
+            referencias_por_archivo[archivo_md].append((clave, referencia))
+
+    claves_unicas = sorted(representantes)
+    if not claves_unicas:
+        return {}
+
+    registro.info(f"Verificando {len(claves_unicas)} imagenes referenciadas...")
+    # Cache del lote: ruta normalizada -> resultado de la inspeccion
+    with ThreadPoolExecutor(max_workers=max_hilos) as ejecutor:
+        resultados = dict(zip(claves_unicas, ejecutor.map(lambda clave: inspeccionar_imagen(*representantes[clave]),
+                                                          claves_unicas)))
+
+    problemas = {}
+    for archivo_md, claves in referencias_por_archivo.items():
+        # La referencia original se conserva para los mensajes de error
+        invalidas = [(referencia, resultados[clave]['problema'])
+                     for clave, referencia in claves
+                     if not resultados[clave]['valida']]
+        if invalidas:
+            problemas[archivo_md] = invalidas
+            for referencia, problema in invalidas:
+                registro.error(f"Imagen invalida en {os.path.basename(archivo_md)}: {referencia} ({problema})")
+
+    return problemas
+
 def optimizar_docx_para_moodle(ruta_archivo_docx):
     """
     Post-procesa el archivo DOCX para optimizar compatibilidad con Moodle
@@ -478,7 +990,8 @@ def optimizar_docx_para_moodle(ruta_archivo_docx):
     except Exception as e:
         registro.warning(f"Error en post-procesamiento: {e}")
 
-def convertir_md_a_word(archivo_entrada, archivo_salida=None, optimizar_para_moodle=True):
+def convertir_md_a_word(archivo_entrada, archivo_salida=None, optimizar_para_moodle=True, al_evento=None,
+                        tiempo_maximo=None, memoria_maxima_mb=None):
     """
     Convierte un archivo Markdown a Word optimizado para importacion en Moodle
     
@@ -486,35 +999,57 @@ def convertir_md_a_word(archivo_entrada, archivo_salida=None, optimizar_para_moo
         archivo_entrada (str): Ruta del archivo .md
         archivo_salida (str): Ruta del archivo .docx (opcional)
         optimizar_para_moodle (bool): Si aplicar optimizaciones especificas para Moodle
+        al_evento (callable): Callback que recibe los eventos de progreso (opcional)
+        tiempo_maximo (float): Segundos maximos para todo el trabajo; al agotarse se
+            detiene el proceso pandoc en curso (opcional)
+        memoria_maxima_mb (int): Memoria maxima de cada proceso pandoc en MB (opcional)
     
     Returns:
         bool: True si la conversion fue exitosa
     """
+    inicio = time.perf_counter()
+    
+    def tiempo_restante():
+        return None if tiempo_maximo is None else tiempo_maximo - (time.perf_counter() - inicio)
+    
+    bytes_entrada = 0
+    ruta_plantilla = None
     try:
         # Validar archivo de entrada
         if not os.path.exists(archivo_entrada):
             registro.error(f"Archivo no encontrado: {archivo_entrada}")
+            emitir_evento(al_evento, EVENTO_ARCHIVO_FALLIDO, archivo=archivo_entrada,
+                          bytes_entrada=0, error="Archivo no encontrado")
             return False
         
+        bytes_entrada = os.path.getsize(archivo_entrada)
+        
         # Generar nombre de archivo de salida si no se proporciona
         if archivo_salida is None:
             ruta_entrada = Path(archivo_entrada)
             archivo_salida = str(ruta_entrada.with_suffix('.docx'))
         
         registro.info(f"Convirtiendo: {archivo_entrada} -> {archivo_salida}")
+        emitir_evento(al_evento, EVENTO_ARCHIVO_INICIADO, archivo=archivo_entrada,
+                      salida=archivo_salida, bytes_entrada=bytes_entrada)
         
         # Pre-procesar Markdown si esta optimizado para Moodle
-        archivo_procesado = archivo_entrada
+        ast_procesado = None
         if optimizar_para_moodle:
-            archivo_procesado = procesar_markdown_previo(archivo_entrada)
-            if archivo_procesado != archivo_entrada:
-                registro.info("Usando archivo pre-procesado para conversion")
+            inicio_etapa = time.perf_counter()
+            ast_procesado = procesar_markdown_previo(archivo_entrada, tiempo_restante(), memoria_maxima_mb)
+            if ast_procesado is not None:
+                registro.info("Usando AST pre-procesado para conversion")
+            emitir_evento(al_evento, EVENTO_ETAPA_FINALIZADA, archivo=archivo_entrada, etapa='preprocesamiento',
+                          duracion_s=round(time.perf_counter() - inicio_etapa, 4))
         
         # Argumentos especificos para compatibilidad con plugin de Moodle
         argumentos_pandoc = [
             '--standalone',
             '--wrap=none',
             '--metadata=title=""',
+            # Las imagenes se resuelven relativas al .md original
+            f'--resource-path={os.path.dirname(os.path.abspath(archivo_entrada))}',
         ]
         
         if optimizar_para_moodle:
@@ -533,45 +1068,59 @@ def convertir_md_a_word(archivo_entrada, archivo_salida=None, optimizar_para_moo
             registro.info("Configurando Heading 1 y Heading 2 para capitulos/subcapitulos")
         
         # Realizar la conversion
-        pypandoc.convert_file(
-            archivo_procesado,
-            'docx',
-            outputfile=archivo_salida,
-            extra_args=argumentos_pandoc
-        )
+        inicio_etapa = time.perf_counter()
+        if ast_procesado is not None:
+            ejecutar_pandoc(
+                ['--from=json', '--to=docx', f'--output={archivo_salida}'] + argumentos_pandoc,
+                json.dumps(ast_procesado).encode('utf-8'),
+                tiempo_restante(),
+                memoria_maxima_mb
+            )
+        else:
+            ejecutar_pandoc(
+                [archivo_entrada, '--from=markdown', '--to=docx', f'--output={archivo_salida}'] + argumentos_pandoc,
+                None,
+                tiempo_restante(),
+                memoria_maxima_mb
+            )
+        emitir_evento(al_evento, EVENTO_ETAPA_FINALIZADA, archivo=archivo_entrada, etapa='pandoc',
+                      duracion_s=round(time.perf_counter() - inicio_etapa, 4))
         
         # Post-procesamiento para Moodle
         if optimizar_para_moodle:
+            inicio_etapa = time.perf_counter()
             optimizar_docx_para_moodle(archivo_salida)
-            
-            # Limpiar archivos temporales
-            for argumento in argumentos_pandoc:
-                if argumento.startswith('--reference-doc='):
-                    plantilla_temporal = argumento.split('=', 1)[1]
-                    if plantilla_temporal and os.path.exists(plantilla_temporal):
-                        try:
-                            os.unlink(plantilla_temporal)
-                        except:
-                            pass
-                    break
-            
-            # Limpiar archivo Markdown temporal
-            if archivo_procesado != archivo_entrada and os.path.exists(archivo_procesado):
-                try:
-                    os.unlink(archivo_procesado)
-                    registro.info("Archivos temporales limpiados")
-                except:
-                    pass
+            emitir_evento(al_evento, EVENTO_ETAPA_FINALIZADA, archivo=archivo_entrada, etapa='postprocesamiento',
+                          duracion_s=round(time.perf_counter() - inicio_etapa, 4))
         
         registro.info(f"Conversion exitosa: {archivo_salida}")
         registro.info("Archivo listo para importar en Moodle Book")
+        emitir_evento(al_evento, EVENTO_ARCHIVO_CONVERTIDO, archivo=archivo_entrada, salida=archivo_salida,
+                      bytes_entrada=bytes_entrada, bytes_salida=os.path.getsize(archivo_salida),
+                      duracion_s=round(time.perf_counter() - inicio, 4))
         return True
         
+    except ErrorLimitePandoc as e:
+        registro.error(f"Trabajo detenido ({archivo_entrada}): {e}")
+        emitir_evento(al_evento, EVENTO_ARCHIVO_FALLIDO, archivo=archivo_entrada, bytes_entrada=bytes_entrada,
+                      error=str(e), motivo=e.motivo, duracion_s=round(time.perf_counter() - inicio, 4))
+        return False
     except Exception as e:
         registro.error(f"Error en conversion: {e}")
+        emitir_evento(al_evento, EVENTO_ARCHIVO_FALLIDO, archivo=archivo_entrada, bytes_entrada=bytes_entrada,
+                      error=str(e), duracion_s=round(time.perf_counter() - inicio, 4))
         return False
+    finally:
+        # Limpiar plantilla temporal tambien si el trabajo fue detenido
+        if ruta_plantilla and os.path.exists(ruta_plantilla):
+            try:
+                os.unlink(ruta_plantilla)
+            except:
+                pass
 
-def convertir_directorio(directorio_entrada, directorio_salida=None, optimizar_para_moodle=True):
+def convertir_directorio(directorio_entrada, directorio_salida=None, optimizar_para_moodle=True,
+                         verificar_imagenes_previo=True, al_evento=None, trabajos=None,
+                         tiempo_maximo=None, memoria_maxima_mb=None, cancelacion=None):
     """
     Convierte todos los archivos .md en un directorio
     
@@ -579,6 +1128,15 @@ def convertir_directorio(directorio_entrada, directorio_salida=None, optimizar_p
         directorio_entrada (str): Directorio con archivos .md
         directorio_salida (str): Directorio de salida (opcional)
         optimizar_para_moodle (bool): Si aplicar optimizaciones para Moodle
+        verificar_imagenes_previo (bool): Si verificar las imagenes de todo el lote antes de convertir
+        al_evento (callable): Callback que recibe los eventos de progreso (opcional). Los eventos
+            de archivo terminado incluyen progreso, rendimiento (bytes/s) y tiempo estimado restante
+        trabajos (int): Maximo de conversiones simultaneas; por defecto el numero de CPUs.
+            La concurrencia real se ajusta a la memoria disponible y al tamano de cada archivo
+        tiempo_maximo (float): Segundos maximos por archivo (opcional)
+        memoria_maxima_mb (int): Memoria maxima por proceso pandoc en MB (opcional)
+        cancelacion (threading.Event): Si se activa, los archivos aun no iniciados se
+            saltan; los que ya estan en curso terminan (opcional)
     
     Returns:
         int: Numero de archivos convertidos exitosamente
@@ -592,28 +1150,115 @@ def convertir_directorio(directorio_entrada, directorio_salida=None, optimizar_p
     
     archivos_md = list(Path(directorio_entrada).glob('*.md'))
     contador_convertidos = 0
+    inicio_lote = time.perf_counter()
     
     registro.info(f"Encontrados {len(archivos_md)} archivos .md en {directorio_entrada}")
     
-    for i, archivo_md in enumerate(archivos_md, 1):
-        registro.info(f"\nProcesando archivo {i}/{len(archivos_md)}: {archivo_md.name}")
-        
-        # Validar estructura antes de convertir
+    tamanos = {archivo_md: archivo_md.stat().st_size for archivo_md in archivos_md}
+    al_evento_con_progreso = None
+    if al_evento is not None:
+        al_evento_con_progreso = crear_seguimiento_progreso(al_evento, sum(tamanos.values()), len(archivos_md))
+    
+    # Registrar los trabajos detenidos por tiempo o memoria para el resumen final
+    trabajos_detenidos = []
+    
+    def registrar_evento_lote(evento):
+        if evento['tipo'] == EVENTO_ARCHIVO_FALLIDO and evento.get('motivo'):
+            trabajos_detenidos.append((evento['archivo'], evento['motivo']))
+        if al_evento_con_progreso is not None:
+            al_evento_con_progreso(evento)
+    
+    emitir_evento(registrar_evento_lote, EVENTO_LOTE_INICIADO, directorio=str(directorio_entrada),
+                  total_archivos=len(archivos_md), bytes_totales=sum(tamanos.values()))
+    for archivo_md in archivos_md:
+        emitir_evento(registrar_evento_lote, EVENTO_ARCHIVO_ENCOLADO, archivo=str(archivo_md),
+                      bytes_entrada=tamanos[archivo_md])
+    
+    # Validar estructura de todo el lote antes de lanzar pandoc
+    archivos_validos = []
+    for archivo_md in archivos_md:
+        inicio_etapa = time.perf_counter()
         estructura = validar_estructura_markdown(str(archivo_md))
+        emitir_evento(registrar_evento_lote, EVENTO_ETAPA_FINALIZADA, archivo=str(archivo_md), etapa='validacion',
+                      duracion_s=round(time.perf_counter() - inicio_etapa, 4))
         
         if estructura.get('cantidad_h1', 0) == 0:
             registro.warning(f"Saltando {archivo_md.name}: No hay capitulos H1 validos")
+            emitir_evento(registrar_evento_lote, EVENTO_ARCHIVO_FALLIDO, archivo=str(archivo_md),
+                          bytes_entrada=tamanos[archivo_md], error="No hay capitulos H1 validos")
             continue
         
-        if directorio_salida:
-            archivo_salida = Path(directorio_salida) / f"{archivo_md.stem}.docx"
-        else:
-            archivo_salida = archivo_md.with_suffix('.docx')
-        
-        if convertir_md_a_word(str(archivo_md), str(archivo_salida), optimizar_para_moodle):
-            contador_convertidos += 1
+        archivos_validos.append((archivo_md, estructura))
+    
+    # Verificar imagenes del lote completo: si falta alguna no se inicia ninguna conversion
+    if verificar_imagenes_previo:
+        inicio_etapa = time.perf_counter()
+        problemas = verificar_imagenes(
+            {str(archivo_md): estructura.get('imagenes', []) for archivo_md, estructura in archivos_validos}
+        )
+        emitir_evento(registrar_evento_lote, EVENTO_ETAPA_FINALIZADA, etapa='verificacion_imagenes',
+                      duracion_s=round(time.perf_counter() - inicio_etapa, 4))
+        if problemas:
+            registro.error(f"Imagenes invalidas en {len(problemas)} archivo(s). No se convirtio ningun archivo.")
+            registro.info("Corrige las rutas o usa --sin-verificar-imagenes para convertir de todos modos")
+            for archivo_md, _ in archivos_validos:
+                invalidas = problemas.get(str(archivo_md))
+                error = (f"Imagenes invalidas: {', '.join(referencia for referencia, _ in invalidas)}"
+                         if invalidas else "Lote cancelado por imagenes invalidas en otros archivos")
+                emitir_evento(registrar_evento_lote, EVENTO_ARCHIVO_FALLIDO, archivo=str(archivo_md),
+                              bytes_entrada=tamanos[archivo_md], error=error)
+            emitir_evento(registrar_evento_lote, EVENTO_LOTE_FINALIZADO, convertidos=0,
+                          total_archivos=len(archivos_md), duracion_s=round(time.perf_counter() - inicio_lote, 4))
+            return 0
+    
+    # Planificar la concurrencia segun la memoria disponible
+    memoria_libre = memoria_disponible_mb()
+    presupuesto = PresupuestoMemoria(int(memoria_libre * FRACCION_MEMORIA_LOTE) if memoria_libre else None)
+    trabajos = max(1, min(trabajos or os.cpu_count() or 1, len(archivos_validos) or 1))
+    registro.info(f"Planificador: hasta {trabajos} trabajos simultaneos, "
+                  f"presupuesto de memoria {presupuesto.total_mb or 'desconocido'} MB")
+    
+    def convertir_trabajo(i, archivo_md):
+        memoria_estimada = estimar_memoria_trabajo_mb(tamanos[archivo_md], memoria_maxima_mb)
+        if not presupuesto.reservar(memoria_estimada):
+            return False
+        try:
+            if cancelacion is not None and cancelacion.is_set():
+                return False
+            
+            registro.info(f"\nProcesando archivo {i}/{len(archivos_validos)}: {archivo_md.name} "
+                          f"(memoria estimada {memoria_estimada} MB)")
+            
+            if directorio_salida:
+                archivo_salida = Path(directorio_salida) / f"{archivo_md.stem}.docx"
+            else:
+                archivo_salida = archivo_md.with_suffix('.docx')
+            
+            return convertir_md_a_word(str(archivo_md), str(archivo_salida), optimizar_para_moodle,
+                                       registrar_evento_lote, tiempo_maximo, memoria_maxima_mb)
+        finally:
+            presupuesto.liberar(memoria_estimada)
+    
+    with ThreadPoolExecutor(max_workers=trabajos) as ejecutor:
+        futuros = [ejecutor.submit(convertir_trabajo, i, archivo_md)
+                   for i, (archivo_md, _) in enumerate(archivos_validos, 1)]
+        try:
+            contador_convertidos = sum(1 for futuro in futuros if futuro.result())
+        except BaseException:
+            # Ctrl+C u otro error: descartar los trabajos pendientes en lugar de
+            # esperar a que terminen al salir del bloque with
+            presupuesto.cancelar()
+            ejecutor.shutdown(wait=False, cancel_futures=True)
+            raise
+    
+    if trabajos_detenidos:
+        registro.error(f"Trabajos detenidos por exceder limites: {len(trabajos_detenidos)}")
+        for archivo, motivo in trabajos_detenidos:
+            registro.error(f"   {os.path.basename(archivo)}: {motivo}")
     
     registro.info(f"\nConversion completada: {contador_convertidos}/{len(archivos_md)} archivos")
+    emitir_evento(registrar_evento_lote, EVENTO_LOTE_FINALIZADO, convertidos=contador_convertidos,
+                  total_archivos=len(archivos_md), duracion_s=round(time.perf_counter() - inicio_lote, 4))
     
     if optimizar_para_moodle and contador_convertidos > 0:
         registro.info("\nArchivos listos para plugin de importacion de libros de Moodle:")
@@ -628,19 +1273,77 @@ def convertir_directorio(directorio_entrada, directorio_salida=None, optimizar_p
     
     return contador_convertidos
 
-def verificar_dependencias():
-    """Verifica que las dependencias esten instaladas"""
+def iterar_eventos_directorio(directorio_entrada, directorio_salida=None, optimizar_para_moodle=True,
+                              verificar_imagenes_previo=True, trabajos=None, tiempo_maximo=None,
+                              memoria_maxima_mb=None):
+    """
+    Convierte un directorio en segundo plano y devuelve sus eventos a medida
+    que se producen, para consumirlos con un simple bucle for
+    
+    Args:
+        directorio_entrada (str): Directorio con archivos .md
+        directorio_salida (str): Directorio de salida (opcional)
+        optimizar_para_moodle (bool): Si aplicar optimizaciones para Moodle
+        verificar_imagenes_previo (bool): Si verificar las imagenes antes de convertir
+        trabajos (int): Maximo de conversiones simultaneas (opcional)
+        tiempo_maximo (float): Segundos maximos por archivo (opcional)
+        memoria_maxima_mb (int): Memoria maxima por proceso pandoc en MB (opcional)
+    
+    Yields:
+        dict: Eventos de progreso en el mismo formato que recibe al_evento
+    
+    Si la conversion falla con una excepcion, esta se relanza en el bucle que
+    consume los eventos. Si el iterador se cierra antes de tiempo (break o
+    close()), no se inician mas archivos, pero los que ya estan en curso
+    terminan en segundo plano sin que se espere por ellos
+    """
+    cola_eventos = queue.Queue()
+    cancelacion = threading.Event()
+    fin = object()
+    
+    def ejecutar():
+        try:
+            convertir_directorio(directorio_entrada, directorio_salida, optimizar_para_moodle,
+                                 verificar_imagenes_previo, al_evento=cola_eventos.put, trabajos=trabajos,
+                                 tiempo_maximo=tiempo_maximo, memoria_maxima_mb=memoria_maxima_mb,
+                                 cancelacion=cancelacion)
+        except BaseException as e:
+            cola_eventos.put(e)
+        finally:
+            cola_eventos.put(fin)
+    
+    hilo = threading.Thread(target=ejecutar, daemon=True)
+    hilo.start()
+    try:
+        while True:
+            evento = cola_eventos.get()
+            if evento is fin:
+                break
+            if isinstance(evento, BaseException):
+                raise evento
+            yield evento
+    finally:
+        cancelacion.set()
+    hilo.join()
+
+def verificar_dependencias(salida=None):
+    """
+    Verifica que las dependencias esten instaladas
+    
+    Args:
+        salida (file): Flujo para las instrucciones de instalacion (por defecto stdout)
+    """
     try:
         version = pypandoc.get_pandoc_version()
         registro.info(f"Pandoc version: {version}")
         return True
     except OSError:
         registro.error("Pandoc no esta instalado.")
-        print("\nPara instalar pandoc:")
-        print("Windows: Descargar desde https://pandoc.org/installing.html")
-        print("Linux: sudo apt-get install pandoc")
-        print("Mac: brew install pandoc")
-        print("O ejecutar: pip install pypandoc && python -c \"import pypandoc; pypandoc.download_pandoc()\"")
+        print("\nPara instalar pandoc:", file=salida)
+        print("Windows: Descargar desde https://pandoc.org/installing.html", file=salida)
+        print("Linux: sudo apt-get install pandoc", file=salida)
+        print("Mac: brew install pandoc", file=salida)
+        print("O ejecutar: pip install pypandoc && python -c \"import pypandoc; pypandoc.download_pandoc()\"", file=salida)
         return False
     except Exception as e:
         registro.error(f"Error verificando dependencias: {e}")
@@ -664,6 +1367,8 @@ Ejemplos de uso:
   %(prog)s -d carpeta_md/                 # Convierte carpeta completa
   %(prog)s archivo.md --sin-moodle        # Sin optimizaciones especificas
   %(prog)s --validar archivo.md           # Solo validar estructura
+  %(prog)s -d carpeta_md/ --eventos jsonl # Progreso estructurado por stdout
+  %(prog)s -d carpeta_md/ --tiempo-maximo 300 --memoria-maxima 2048
         """
     )
     
@@ -675,22 +1380,44 @@ Ejemplos de uso:
                            help='Desactivar optimizaciones especificas para Moodle')
     analizador.add_argument('--validar', action='store_true',
                            help='Solo validar estructura Markdown sin convertir')
+    analizador.add_argument('--sin-verificar-imagenes', action='store_true',
+                           help='No verificar que las imagenes referenciadas existan antes de convertir')
+    analizador.add_argument('--trabajos', type=int,
+                           help='Modo directorio: maximo de conversiones simultaneas (por defecto: CPUs, '
+                                'ajustado a la memoria disponible)')
+    analizador.add_argument('--tiempo-maximo', type=float, metavar='SEGUNDOS',
+                           help='Detener la conversion de un archivo que supere este tiempo')
+    analizador.add_argument('--memoria-maxima', type=int, metavar='MB',
+                           help='Limite de memoria por proceso pandoc (+RTS -M y RLIMIT_AS)')
+    analizador.add_argument('--eventos', '--events', choices=['jsonl'],
+                           help='Emitir eventos de progreso estructurados por stdout (un JSON por linea)')
     analizador.add_argument('-v', '--verbose', action='store_true', help='Salida detallada')
     
     argumentos = analizador.parse_args()
     
-    # Configurar nivel de logging
-    if argumentos.verbose:
-        logging.getLogger().setLevel(logging.DEBUG)
+    # Configurar logging (siempre por stderr)
+    configurar_registro(argumentos.verbose)
+    
+    # Con --eventos, stdout queda reservado para los eventos y los mensajes van a stderr
+    def escribir_evento_jsonl(evento):
+        sys.stdout.write(json.dumps(evento, ensure_ascii=False) + '\n')
+        sys.stdout.flush()
+    
+    eventos_activos = argumentos.eventos == 'jsonl'
+    al_evento = escribir_evento_jsonl if eventos_activos else None
+    salida_mensajes = sys.stderr if eventos_activos else sys.stdout
+    
+    def mostrar(*mensajes):
+        print(*mensajes, file=salida_mensajes)
     
     # Verificar dependencias
-    if not verificar_dependencias():
+    if not verificar_dependencias(salida_mensajes):
         return 1
     
     # Si no hay argumentos, mostrar ayuda
     if not argumentos.entrada:
-        analizador.print_help()
-        print("\nEste programa esta optimizado para el plugin de importacion de libros de Moodle")
+        analizador.print_help(salida_mensajes)
+        mostrar("\nEste programa esta optimizado para el plugin de importacion de libros de Moodle")
         return 0
     
     optimizar_para_moodle = not argumentos.sin_moodle
@@ -703,56 +1430,80 @@ Ejemplos de uso:
     
     # Solo validar estructura
     if argumentos.validar:
+        imagenes_por_archivo = {}
         if argumentos.directorio:
             archivos_md = list(Path(argumentos.entrada).glob('*.md'))
             for archivo_md in archivos_md:
                 registro.info(f"\nValidando: {archivo_md.name}")
-                validar_estructura_markdown(str(archivo_md))
+                estructura = validar_estructura_markdown(str(archivo_md))
+                imagenes_por_archivo[str(archivo_md)] = estructura.get('imagenes', [])
         else:
-            validar_estructura_markdown(argumentos.entrada)
+            estructura = validar_estructura_markdown(argumentos.entrada)
+            imagenes_por_archivo[argumentos.entrada] = estructura.get('imagenes', [])
+        
+        if not argumentos.sin_verificar_imagenes:
+            problemas = verificar_imagenes(imagenes_por_archivo)
+            if problemas:
+                return 1
+            registro.info("Todas las imagenes referenciadas son validas")
         return 0
     
     # Modo directorio
     if argumentos.directorio:
-        convertidos = convertir_directorio(argumentos.entrada, argumentos.salida, optimizar_para_moodle)
+        convertidos = convertir_directorio(argumentos.entrada, argumentos.salida, optimizar_para_moodle,
+                                           not argumentos.sin_verificar_imagenes, al_evento, argumentos.trabajos,
+                                           argumentos.tiempo_maximo, argumentos.memoria_maxima)
         if convertidos > 0:
-            print(f"\n{convertidos} archivos convertidos exitosamente!")
+            mostrar(f"\n{convertidos} archivos convertidos exitosamente!")
             if optimizar_para_moodle:
-                print("Listos para importar en Moodle Book!")
+                mostrar("Listos para importar en Moodle Book!")
         return 0 if convertidos > 0 else 1
     
     # Validar estructura del archivo individual
     estructura = validar_estructura_markdown(argumentos.entrada)
     
+    # Verificar imagenes antes de lanzar pandoc
+    if not argumentos.sin_verificar_imagenes:
+        problemas = verificar_imagenes({argumentos.entrada: estructura.get('imagenes', [])})
+        if problemas:
+            invalidas = problemas[argumentos.entrada]
+            emitir_evento(al_evento, EVENTO_ARCHIVO_FALLIDO, archivo=argumentos.entrada,
+                          bytes_entrada=os.path.getsize(argumentos.entrada),
+                          error=f"Imagenes invalidas: {', '.join(referencia for referencia, _ in invalidas)}")
+            mostrar("\nHay imagenes invalidas. Corrige las rutas o usa --sin-verificar-imagenes.")
+            return 1
+    
     # Modo archivo individual
-    if convertir_md_a_word(argumentos.entrada, argumentos.salida, optimizar_para_moodle):
+    if convertir_md_a_word(argumentos.entrada, argumentos.salida, optimizar_para_moodle, al_evento,
+                           argumentos.tiempo_maximo, argumentos.memoria_maxima):
         nombre_salida = argumentos.salida or argumentos.entrada.replace('.md', '.docx')
-        print(f"\nArchivo convertido exitosamente: {nombre_salida}")
+        mostrar(f"\nArchivo convertido exitosamente: {nombre_salida}")
         
         if optimizar_para_moodle:
-            print("Listo para importar en Moodle Book!")
-            print("\nPasos para importar:")
-            print("   1. ELinea -> Tu curso -> Actividades -> Libro")
-            print("   2. Crear nuevo libro")  
-            print("   3. Configuracion -> Importar capitulos")
-            print("   4. Subir archivo .docx")
+            mostrar("Listo para importar en Moodle Book!")
+            mostrar("\nPasos para importar:")
+            mostrar("   1. ELinea -> Tu curso -> Actividades -> Libro")
+            mostrar("   2. Crear nuevo libro")  
+            mostrar("   3. Configuracion -> Importar capitulos")
+            mostrar("   4. Subir archivo .docx")
             
             # Mostrar vista previa de estructura esperada
             if estructura.get('cantidad_h1', 0) > 0:
-                print(f"\nSe crearan {estructura['cantidad_h1']} capitulos")
+                mostrar(f"\nSe crearan {estructura['cantidad_h1']} capitulos")
             if estructura.get('cantidad_h2', 0) > 0:
-                print(f"Se crearan {estructura['cantidad_h2']} subcapitulos")
+                mostrar(f"Se crearan {estructura['cantidad_h2']} subcapitulos")
         
         return 0
     else:
-        print("\nError en la conversion. Ver detalles arriba.")
+        mostrar("\nError en la conversion. Ver detalles arriba.")
         return 1
 
 if __name__ == "__main__":
     try:
         sys.exit(main())
     except KeyboardInterrupt:
-        print("\n\nConversion cancelada por el usuario.")
+        # A stderr: con --eventos, stdout solo lleva eventos JSON
+        print("\n\nConversion cancelada por el usuario.", file=sys.stderr)
         sys.exit(1)
     except Exception as e:
         registro.error(f"Error inesperado: {e}")